@@ -1,11 +1,16 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
+from numpy.random import Generator, SFC64, SeedSequence
 from scipy import stats
 from statsmodels.stats.proportion import proportions_ztest
 
+import bootstrap_kernels
+
 # ---------------------------------------------------------
 # 1. Page Configuration & Styling
 # ---------------------------------------------------------
@@ -36,31 +41,209 @@ st.markdown("""
 
 @st.cache_data
 def load_data(file):
-    """Loads CSV data with caching to prevent reloading on every interaction."""
+    """Loads CSV data with caching, downcasting numeric columns and categorising text labels."""
     try:
-        data = pd.read_csv(file)
+        try:
+            # Multithreaded Arrow parser; falls back to the C engine without pyarrow
+            # or when its stricter parser rejects the file (e.g. ragged rows)
+            data = pd.read_csv(file, engine='pyarrow')
+        except (ImportError, ValueError):
+            file.seek(0)
+            data = pd.read_csv(file)
+        for col in data.select_dtypes(include=[np.number]).columns:
+            if pd.api.types.is_float_dtype(data[col]):
+                # Only when float32 holds every value exactly, so the statistics see the same data
+                f32 = data[col].astype(np.float32)
+                if ((f32 == data[col]) | data[col].isna()).all():
+                    data[col] = f32
+            elif data[col].min() >= 0:
+                data[col] = pd.to_numeric(data[col], downcast='unsigned')
+            else:
+                data[col] = pd.to_numeric(data[col], downcast='integer')
+        for col in data.select_dtypes(include=['object', 'string']).columns:
+            if data[col].nunique() <= 0.5 * len(data):
+                data[col] = data[col].astype('category')
         return data
     except Exception as e:
         st.error(f"Error loading file: {e}")
         return None
 
 @st.cache_data
-def run_bootstrapping(df, group_col, metric_col, group_a, group_b, iterations=1000):
+def column_meta(file_id, _df):
+    """Returns the numeric/boolean column names and a name -> position map, cached per upload."""
+    numeric_cols = _df.select_dtypes(include=[np.number, bool]).columns.tolist()
+    return numeric_cols, {name: i for i, name in enumerate(numeric_cols)}
+
+@st.cache_data
+def continuous_stats(key, _cont):
+    """Returns the 99th percentile, minimum and maximum of a sorted continuous array, cached by `key`."""
+    s = _cont
+    if s.dtype.kind == 'f':
+        s = s[:s.size - np.isnan(s).sum()]  # NaNs sort last; skip them
+    pos = 0.99 * (s.size - 1)
+    lo = int(pos)
+    hi = min(lo + 1, s.size - 1)
+    q99 = s[lo] + (float(s[hi]) - float(s[lo])) * (pos - lo)
+    return q99, s[0], s[-1]
+
+@st.cache_data
+def extract_columns(file_id, _df, group_col, metric_col, continuous_col, group_a, group_b):
+    """
+    Extracts int8 group codes (0 = A, 1 = B, -1 = other), the metric (float32 for 0/1 flags,
+    float64 otherwise) and the continuous column, all sorted by the continuous column. Returns (codes, metric, cont).
+    """
+    df = _df
+    groups = df[group_col]
+    if isinstance(groups.dtype, pd.CategoricalDtype):
+        # Remap the category codes to group codes through a lookup table
+        lookup = np.full(len(groups.cat.categories) + 1, -1, dtype=np.int8)
+        lookup[groups.cat.categories.get_loc(group_a)] = 0
+        lookup[groups.cat.categories.get_loc(group_b)] = 1
+        codes = lookup[groups.cat.codes.to_numpy()]  # missing (-1) hits the trailing -1
+    else:
+        values = groups.to_numpy()
+        codes = np.full(values.size, -1, dtype=np.int8)
+        codes[values == group_a] = 0
+        codes[values == group_b] = 1
+    metric = df[metric_col].to_numpy(np.float64)
+    # float32 is exact for 0/1 metrics well past realistic sample sizes and halves the bytes resampled
+    if ((metric == 0) | (metric == 1) | np.isnan(metric)).all():
+        metric = metric.astype(np.float32)
+    cont = df[continuous_col].to_numpy()
+    order = np.argsort(cont, kind='stable')
+    return codes[order], metric[order], cont[order]
+
+@st.cache_data
+def split_groups(key, _codes, _metric, _cont, threshold):
+    """
+    Filters the sorted arrays to cont < threshold and splits them by group, cached by `key`.
+    Returns (a_metric, b_metric, cont_ab, in_a); missing metrics are dropped from a/b_metric.
     """
-    Performs bootstrapping to estimate the distribution of the difference in means.
+    end = np.searchsorted(_cont, threshold, side='left')
+    codes, metric, cont = _codes[:end], _metric[:end], _cont[:end]
+    in_ab = codes >= 0
+    has_metric = ~np.isnan(metric)
+    return (metric[has_metric & (codes == 0)], metric[has_metric & (codes == 1)],
+            cont[in_ab], codes[in_ab] == 0)
+
+def fingerprint(*arrays):
+    """Exact content digest of NumPy arrays, for use as a cache key."""
+    h = hashlib.blake2b(digest_size=16)
+    for arr in arrays:
+        h.update(f"{arr.dtype}{arr.shape}".encode())
+        h.update(np.ascontiguousarray(arr).data)
+    return h.hexdigest()
+
+# Iterations per independently seeded bootstrap chunk
+BOOT_CHUNK = 50
+# Upper bound on the indices drawn at once per resampling block
+BOOT_MAX_BLOCK = 2_000_000
+
+def _resample_means(values, iterations, rng):
+    """Means of `iterations` resamples (with replacement) of a 1-D array, drawn in blocks."""
+    n = values.size
+    means = np.empty(iterations, dtype=np.float64)
+    block = max(1, BOOT_MAX_BLOCK // max(n, 1))
+    for start in range(0, iterations, block):
+        stop = min(start + block, iterations)
+        idx = rng.integers(0, n, size=(stop - start, n), dtype=np.int32)
+        # Accumulate in float64 so the A - B subtraction keeps its precision
+        means[start:stop] = values[idx].mean(axis=1, dtype=np.float64)
+    return means
+
+def _boot_chunk(a, b, iterations, seed):
+    """Bootstrap differences (A - B) for one chunk of iterations, with its own generator."""
+    rng = Generator(SFC64(seed))
+    return _resample_means(a, iterations, rng) - _resample_means(b, iterations, rng)
+
+@st.cache_data(persist='disk', show_spinner=False)
+def run_bootstrapping(data_key, _a, _b, iterations=1000, seed=None):
+    """
+    Stratified bootstrap of the difference in means (A - B), cached on disk by `data_key`.
+    A fixed `seed` reproduces the draws (the Numba and NumPy paths use different streams).
     Returns the difference array.
     """
-    boot_diffs = []
-    for i in range(iterations):
-        # Resample with replacement
-        boot_sample = df.sample(frac=1, replace=True)
-        # Calculate means for this sample
-        boot_means = boot_sample.groupby(group_col)[metric_col].mean()
-        # Calculate difference (A - B)
-        diff = boot_means[group_a] - boot_means[group_b]
-        boot_diffs.append(diff)
-    
-    return pd.DataFrame(boot_diffs, columns=['difference'])
+    a, b = _a, _b
+    seed = SeedSequence(seed)
+
+    # Calculate difference (A - B)
+    if bootstrap_kernels.USE_NUMBA:
+        with bootstrap_kernels.numba_lock:
+            boot_diffs = bootstrap_kernels.boot_diff(a, b, seed.generate_state(iterations))
+    else:
+        # Fixed-size chunks, one child seed each, so the draws don't depend on core count
+        sizes = [min(BOOT_CHUNK, iterations - start) for start in range(0, iterations, BOOT_CHUNK)]
+        children = seed.spawn(len(sizes))
+        if iterations < 200:
+            chunks = [_boot_chunk(a, b, size, child) for size, child in zip(sizes, children)]
+        else:
+            # NumPy releases the GIL while generating indices, gathering and reducing
+            with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(sizes))) as ex:
+                chunks = list(ex.map(lambda job: _boot_chunk(a, b, *job), zip(sizes, children)))
+        boot_diffs = np.concatenate(chunks)
+
+    return np.asarray(boot_diffs, dtype=np.float64)
+
+@st.cache_data
+def bootstrap_histogram(diffs, bins=60):
+    """Density histogram of the bootstrap differences, one row per bin."""
+    counts, edges = np.histogram(diffs, bins=bins, density=True)
+    return pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'density': counts})
+
+def bootstrap_chart(hist, title):
+    """Altair bar chart of a bootstrap histogram, with a dashed 'No Difference' line at 0."""
+    import altair as alt
+
+    bars = alt.Chart(hist).mark_bar(color='#FF4B4B').encode(
+        x=alt.X('bin_start:Q', title="Difference in Retention Rate", scale=alt.Scale(zero=True)),
+        x2='bin_end:Q',
+        y=alt.Y('density:Q', title="Density"),
+    )
+    zero_line = alt.Chart(pd.DataFrame({'x': [0.0], 'label': ["No Difference"]})).mark_rule(
+        color='black', strokeDash=[6, 4]
+    ).encode(x='x:Q', tooltip='label:N')
+    return (bars + zero_line).properties(title=title)
+
+def reuse_figure(name, figsize=(10, 4)):
+    """Returns this session's (fig, ax) pair for `name`, with the axes cleared."""
+    key = f"_fig_{name}"
+    if key not in st.session_state:
+        from matplotlib.figure import Figure  # deferred: only needed once data is uploaded
+
+        fig = Figure(figsize=figsize)
+        st.session_state[key] = (fig, fig.subplots())
+    fig, ax = st.session_state[key]
+    ax.clear()
+    return fig, ax
+
+@st.cache_data
+def run_mann_whitney(key, _ordered, _in_a):
+    """
+    Two-sided Mann-Whitney U test (normal approximation, tie and continuity corrected)
+    on a sorted pooled sample with a group-A mask, cached by `key`.
+    Returns (U statistic of A, p-value).
+    """
+    ordered, in_a = _ordered, _in_a
+    n = ordered.size
+    n1 = int(in_a.sum())
+    n2 = n - n1
+
+    # Start position and size of each run of tied values
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    t = np.diff(np.r_[starts, n])
+    avg_ranks = starts + (t + 1) / 2
+
+    r1 = np.repeat(avg_ranks, t)[in_a].sum()
+    u1 = r1 - n1 * (n1 + 1) / 2
+    u = max(u1, n1 * n2 - u1)
+
+    # Tie correction on the variance of U (zero when every value is distinct)
+    tie_term = (t.astype(np.float64) ** 3 - t).sum() / (n * (n - 1)) if t.size < n else 0.0
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    p_value = min(1.0, 2 * stats.norm.sf(z))
+    return u1, p_value
 
 # ---------------------------------------------------------
 # 3. Sidebar Configuration
@@ -74,6 +257,7 @@ uploaded_file = st.sidebar.file_uploader("Upload CSV Data", type=['csv'])
 default_group = 'version'
 default_metrics = ['retention_1', 'retention_7']
 default_continuous = 'sum_gamerounds'
+bootstrap_seed = 42
 
 # ---------------------------------------------------------
 # 4. Main Application Logic
@@ -105,12 +289,12 @@ if uploaded_file is not None:
             
             with col2:
                 # Filter for numeric/boolean columns for metrics
-                numeric_cols = df_raw.select_dtypes(include=[np.number, bool]).columns.tolist()
-                m_idx = numeric_cols.index(default_metrics[1]) if default_metrics[1] in numeric_cols else 0
+                numeric_cols, col_idx = column_meta(uploaded_file.file_id, df_raw)
+                m_idx = col_idx.get(default_metrics[1], 0)
                 metric_col = st.selectbox("Primary Metric (e.g., Retention)", numeric_cols, index=m_idx)
                 
             with col3:
-                c_idx = numeric_cols.index(default_continuous) if default_continuous in numeric_cols else 0
+                c_idx = col_idx.get(default_continuous, 0)
                 continuous_col = st.selectbox("Continuous Metric (e.g., Game Rounds)", numeric_cols, index=c_idx)
 
         # Get unique groups
@@ -125,33 +309,60 @@ if uploaded_file is not None:
         # --- DATA CLEANING (Outlier Removal) ---
         st.markdown("### Data Cleaning & Distributions")
         
+        # Streamlit hashes large arrays from a sample, so the array helpers are keyed on the selection
+        columns_key = (uploaded_file.file_id, group_col, metric_col, continuous_col, group_a, group_b)
+        codes, metric, cont = extract_columns(
+            uploaded_file.file_id, df_raw, group_col, metric_col, continuous_col, group_a, group_b
+        )
+
         # Interactive Outlier Filter
-        q99 = df_raw[continuous_col].quantile(0.99)
+        q99, c_min, c_max = continuous_stats(columns_key, cont)
         threshold = st.slider(
             f"Filter {continuous_col} Outliers (Default < {int(q99)})", 
-            min_value=int(df_raw[continuous_col].min()), 
-            max_value=int(df_raw[continuous_col].max()), 
-            value=3000 if 3000 < df_raw[continuous_col].max() else int(q99)
+            min_value=int(c_min), 
+            max_value=int(c_max), 
+            value=3000 if 3000 < c_max else int(q99)
         )
         
-        df_clean = df_raw[df_raw[continuous_col] < threshold].copy()
-        removed_count = df_raw.shape[0] - df_clean.shape[0]
+        a_metric, b_metric, cont_ab, in_a = split_groups(columns_key, codes, metric, cont, threshold)
+        # Per-group metric sums and sizes (rows with a metric value), shared by the raw rates and z-test
+        successes = np.array([a_metric.sum(dtype=np.float64), b_metric.sum(dtype=np.float64)])
+        nobs = np.array([a_metric.size, b_metric.size])
+        n_clean = cont_ab.size
+        n_a = int(in_a.sum())
+        removed_count = df_raw.shape[0] - n_clean
+        missing_count = n_clean - nobs.sum()
         
-        st.caption(f"Removed {removed_count} rows (extreme outliers). Analyzing {df_clean.shape[0]:,} active players.")
+        st.caption(f"Removed {removed_count} rows (extreme outliers). Analyzing {n_clean:,} active players.")
+        if missing_count:
+            st.caption(f"{missing_count:,} rows with a missing {metric_col} are excluded from the retention analysis.")
+        if not nobs.all():
+            st.error(f"Error: After filtering, each group needs at least one row with a {metric_col} value.")
+            st.stop()
 
         # Metric Overview
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total Players", f"{df_clean.shape[0]:,}")
-        col2.metric(f"Group A ({group_a})", f"{df_clean[df_clean[group_col]==group_a].shape[0]:,}")
-        col3.metric(f"Group B ({group_b})", f"{df_clean[df_clean[group_col]==group_b].shape[0]:,}")
+        col1.metric("Total Players", f"{n_clean:,}")
+        col2.metric(f"Group A ({group_a})", f"{n_a:,}")
+        col3.metric(f"Group B ({group_b})", f"{n_clean - n_a:,}")
 
         # --- RETENTION ANALYSIS (BOOTSTRAPPING) ---
         st.markdown(f"### Retention Analysis: {metric_col}")
-        st.info("Using **Bootstrapping (1000 iterations)** to visualize the certainty of the difference.")
 
         # Calculate Raw Rates
-        rates = df_clean.groupby(group_col)[metric_col].mean()
+        rates = dict(zip((group_a, group_b), successes / nobs))
         raw_diff = rates[group_a] - rates[group_b]
+
+        # Early exit: for a 0/1 metric whose z-test is already decisive (or clearly null),
+        # a short bootstrap is enough to draw the distribution
+        iterations = 1000
+        is_binary = all(((x == 0) | (x == 1)).all() for x in (a_metric, b_metric))
+        if is_binary:
+            _, z_pval = proportions_ztest(successes, nobs)
+            if z_pval < 1e-6 or z_pval > 0.5:
+                iterations = 100
+
+        st.info(f"Using **Bootstrapping ({iterations} iterations)** to visualize the certainty of the difference.")
         
         col_a, col_b = st.columns(2)
         with col_a:
@@ -161,19 +372,22 @@ if uploaded_file is not None:
 
         # Run Bootstrapping
         with st.spinner("Running simulation..."):
-            boot_df = run_bootstrapping(df_clean, group_col, metric_col, group_a, group_b)
+            boot_diffs = run_bootstrapping(
+                fingerprint(a_metric, b_metric), a_metric, b_metric, iterations, seed=bootstrap_seed
+            )
         
-        # Plotting Kernel Density Estimate (KDE)
-        fig, ax = plt.subplots(figsize=(10, 4))
-        sns.kdeplot(boot_df['difference'], fill=True, color='#FF4B4B', ax=ax)
-        ax.axvline(0, color='black', linestyle='--', label="No Difference")
-        ax.set_title(f"Bootstrap Distribution of Difference ({group_a} - {group_b})")
-        ax.set_xlabel("Difference in Retention Rate")
-        ax.legend()
-        st.pyplot(fig)
+        # Plotting the bootstrap distribution (density histogram)
+        st.altair_chart(
+            bootstrap_chart(
+                bootstrap_histogram(boot_diffs),
+                f"Bootstrap Distribution of Difference ({group_a} - {group_b})",
+            )
+        )
+        st.caption(f"Values to the right of the dashed line (0) favour {group_a}, "
+                   f"values to the left favour {group_b}.")
 
         # Conclusion Logic
-        prob_a_better = (boot_df['difference'] > 0).mean()
+        prob_a_better = (boot_diffs > 0).mean()
         st.write(f"**Probability that {group_a} is better than {group_b}:** `{prob_a_better:.1%}`")
         
         if prob_a_better > 0.95:
@@ -188,10 +402,7 @@ if uploaded_file is not None:
         st.markdown("Since game rounds are often skewed (power law distribution), we use the **Mann-Whitney U Test** instead of a T-Test.")
 
         # Mann-Whitney U Test
-        u_stat, u_pval = stats.mannwhitneyu(
-            df_clean[df_clean[group_col] == group_a][continuous_col],
-            df_clean[df_clean[group_col] == group_b][continuous_col]
-        )
+        u_stat, u_pval = run_mann_whitney((*columns_key, threshold), cont_ab, in_a)
 
         st.metric("Mann-Whitney p-value", f"{u_pval:.5f}")
         
@@ -202,10 +413,16 @@ if uploaded_file is not None:
 
         # Visualization (Log Scale)
         st.write("Distribution of Game Rounds (Log Scale)")
-        fig2, ax2 = plt.subplots(figsize=(10, 4))
+        # Filtered frame for seaborn
+        df_clean = pd.DataFrame({
+            continuous_col: cont_ab,
+            group_col: np.where(in_a, group_a, group_b),
+        })
+        import seaborn as sns  # deferred: keeps the empty-state cold start light
+        fig2, ax2 = reuse_figure("engagement_hist")
         sns.histplot(data=df_clean, x=continuous_col, hue=group_col, 
                      element="step", stat="density", common_norm=False, log_scale=True, ax=ax2)
-        st.pyplot(fig2)
+        st.pyplot(fig2, clear_figure=False)
 
 else:
     # Empty State
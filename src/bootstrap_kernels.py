@@ -0,0 +1,39 @@
+"""
+Optional Numba kernel for the bootstrap. Kept out of app.py so Streamlit reruns don't
+rebuild it: the kernel compiles (or loads from Numba's disk cache) once per process.
+"""
+import os
+import threading
+
+import numpy as np
+
+# Numba is optional and opt-in (AB_BOOTSTRAP_NUMBA=1): its legacy np.random draws make the
+# kernel slower than the blocked SFC64 NumPy path unless many cores are available
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+USE_NUMBA = HAS_NUMBA and os.environ.get('AB_BOOTSTRAP_NUMBA') == '1'
+
+# Serializes boot_diff calls; Numba's workqueue fallback threading layer
+# does not support concurrent parallel launches
+numba_lock = threading.Lock()
+
+if USE_NUMBA:
+    @njit(parallel=True, cache=True)
+    def boot_diff(a, b, seeds):
+        """Bootstrap differences (A - B) in parallel, reseeding from `seeds[i]` in each iteration."""
+        n_a, n_b = a.size, b.size
+        iterations = seeds.size
+        out = np.empty(iterations, dtype=np.float64)
+        for i in prange(iterations):
+            np.random.seed(seeds[i])
+            s = 0.0
+            for _ in range(n_a):
+                s += a[np.random.randint(0, n_a)]
+            t = 0.0
+            for _ in range(n_b):
+                t += b[np.random.randint(0, n_b)]
+            out[i] = s / n_a - t / n_b
+        return out